@@ -1,18 +1,138 @@
 import streamlit as st
-from openai import OpenAI
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 import os
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup
+import asyncio
+import base64
+import contextlib
+import copy
+import functools
+import hashlib
 import json
+import queue
+import re
+import sqlite3
+import textwrap
+import threading
 import time
 import datetime
 import uuid
-from typing import List, Dict, Optional, Any, Tuple
+from typing import List, Dict, Optional, Any, Tuple, Callable
 from enum import Enum
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 load_dotenv()
-client = OpenAI()
+DEBUG = os.getenv("DEBUG", "").lower() in ("1", "true", "yes")
+
+_STRIP_RE = re.compile(r'<(script|style|svg)\b[^>]*>.*?</\1\s*>|<!--.*?-->', re.DOTALL | re.IGNORECASE)
+_META_RE = re.compile(r'<meta\b[^>]*/?>', re.IGNORECASE)
+_CONTENT_CACHE_SIZE = 8
+_SKELETON_SELECTOR = "a,button,input,select,textarea,[role=button],[onclick],label,h1,h2,h3"
+_SKELETON_TEST_ATTRS = ("data-testid", "data-test", "data-qa")
+# Other elements with an id, class or test hook are listed with their own text, so values
+# like prices can be targeted with id/class/css selectors
+_SKELETON_TEXT_SELECTOR = ",".join([_SKELETON_SELECTOR, "[id]", "[class]"] + [f"[{attr}]" for attr in _SKELETON_TEST_ATTRS])
+_SKELETON_ATTRS = ("id", "class", "role", "name", "type", "value", "placeholder", "aria-label", "href") + _SKELETON_TEST_ATTRS
+_SKELETON_TARGET_ATTRS = ("id", "class") + _SKELETON_TEST_ATTRS
+# Generated CSS-in-JS class names (styled-components "sc-4dc495c1-1", "lbQcRY", ...) change per
+# build and only add noise
+_HASHED_CLASS_RE = re.compile(r'^(?:sc|css|jsx|emotion)-[\w-]*$|^(?=[a-zA-Z]{5,6}$)(?=.*[a-z])(?=.[a-z]*[A-Z])')
+_SKELETON_CLASS_LIMIT = 3
+_SKELETON_TEXT_LIMIT = 120
+_SKELETON_MAX_ELEMENTS = 400
+_SKELETON_BODY_TEXT_LIMIT = 4000
+_LOG_COMPRESS_THRESHOLD = 2048
+_ACTION_CACHE_SIZE = 128
+_ACTION_CACHE_DB_SIZE = 1024
+_ACTION_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "browseragent", "actions.sqlite")
+_PARTIAL_EXPLANATION_RE = re.compile(r'"explanation"\s*:\s*"((?:[^"\\]|\\.)*)')
+_DANGLING_ESCAPE_RE = re.compile(r'\\(?:u[0-9a-fA-F]{0,3})?$')
+
+# Playwright, OpenAI and the HTML parsers are imported where they're first used so
+# the Streamlit page renders without paying for them
+
+@functools.lru_cache(maxsize=None)
+def _lexbor_parser_class():
+    try:
+        from selectolax.lexbor import LexborHTMLParser
+    except ImportError:
+        return None
+    return LexborHTMLParser
+
+@functools.lru_cache(maxsize=None)
+def _soup_selector(selector: str):
+    import soupsieve
+    return soupsieve.compile(selector)
+
+def _strip_noise(html_content: str) -> str:
+    return _META_RE.sub('', _STRIP_RE.sub('', html_content))
+
+def _decode_partial_json_string(text: str) -> Optional[str]:
+    # A streamed string can stop mid-escape (e.g. "\u00"), so retry without the tail
+    for candidate in (text, _DANGLING_ESCAPE_RE.sub('', text)):
+        try:
+            return json.loads(f'"{candidate}"')
+        except ValueError:
+            continue
+    return None
+
+def _clean_class(value: Any) -> str:
+    # bs4 parses class into a list of names, Lexbor leaves it as a string
+    names = value if isinstance(value, list) else (value or "").split()
+    return " ".join([name for name in names if not _HASHED_CLASS_RE.match(name)][:_SKELETON_CLASS_LIMIT])
+
+def _serialize_state(state: Dict) -> str:
+    return json.dumps(state, ensure_ascii=False, separators=(",", ":"))
+
+# Log and debug dump writes are serialized and written by a single daemon thread so
+# disk I/O stays off the Streamlit script threads
+_WRITER_LOCAL = threading.local()
+
+def _log_worker(log_q: queue.Queue) -> None:
+    while True:
+        path, mode, render = log_q.get()
+        try:
+            with open(path, mode) as f:
+                f.write(render())
+        except Exception as e:
+            print(f"Error writing {path}: {str(e)}")
+        finally:
+            log_q.task_done()
+
+@st.cache_resource
+def _log_queue() -> queue.Queue:
+    # Cached per process: Streamlit re-executes this module on every rerun, so a plain
+    # module-level thread would be started again each time
+    log_q = queue.Queue()
+    threading.Thread(target=_log_worker, args=(log_q,), daemon=True).start()
+    return log_q
+
+def _write_async(path: str, mode: str, render: Callable[[], str]) -> None:
+    _log_queue().put((path, mode, render))
+
+def _zstd_compressor():
+    # Only called from the writer thread; zstd compressors aren't safe to share across threads
+    if not hasattr(_WRITER_LOCAL, "zstd"):
+        try:
+            import zstandard
+            _WRITER_LOCAL.zstd = zstandard.ZstdCompressor(level=3)
+        except ImportError:
+            _WRITER_LOCAL.zstd = None
+    return _WRITER_LOCAL.zstd
+
+def _serialize_log_entry(log_entry: Dict) -> str:
+    compressor = _zstd_compressor()
+    if compressor is not None:
+        # Page state dominates the log size, so store large message bodies zstd-compressed
+        messages = []
+        for message in log_entry["messages"]:
+            content = message.get("content")
+            if isinstance(content, str) and len(content) > _LOG_COMPRESS_THRESHOLD:
+                compressed = base64.b64encode(compressor.compress(content.encode())).decode()
+                message = {**message, "content": {"__zstd__": compressed}}
+            messages.append(message)
+        log_entry = {**log_entry, "messages": messages}
+    return json.dumps(log_entry, separators=(",", ":")) + "\n"
 
 class ActionType(Enum):
     CLICK = "click"
@@ -29,88 +149,141 @@ class SelectorType(Enum):
     TEXT = "text"
     CSS = "css"
 
-class BrowserAction:
-    def __init__(self, 
-                 action_type: ActionType,
-                 selector_type: Optional[SelectorType] = None,
-                 selector: Optional[str] = None,
-                 input_value: Optional[str] = None,
-                 requires_user_input: bool = False,
-                 user_prompt: Optional[str] = None,
-                 timeout: int = 10000):
-        self.action_type = action_type
-        self.selector_type = selector_type
-        self.selector = selector
-        self.input_value = input_value
-        self.requires_user_input = requires_user_input
-        self.user_prompt = user_prompt
-        self.timeout = timeout
+_ACTION_FIELDS = {
+    "action_type": {"type": "string", "enum": [action.value for action in ActionType]},
+    "selector_type": {"type": ["string", "null"], "enum": [selector.value for selector in SelectorType] + [None]},
+    "selector": {"type": ["string", "null"]},
+    "input_value": {"type": ["string", "null"]},
+    "requires_user_input": {"type": "boolean"},
+    "user_prompt": {"type": ["string", "null"]},
+    "timeout": {"type": ["integer", "null"]},
+    "explanation": {"type": "string"},
+}
+
+_ACTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        **_ACTION_FIELDS,
+        "fallback_action": {
+            "anyOf": [
+                {"type": "object", "properties": _ACTION_FIELDS, "required": list(_ACTION_FIELDS), "additionalProperties": False},
+                {"type": "null"},
+            ]
+        },
+    },
+    "required": list(_ACTION_FIELDS) + ["fallback_action"],
+    "additionalProperties": False,
+}
+
+_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "browser_action", "strict": True, "schema": _ACTION_SCHEMA},
+}
+
+_SELECTOR_PREFIX = {
+    SelectorType.ID.value: "#",
+    SelectorType.CLASS.value: ".",
+    SelectorType.XPATH.value: "",
+    SelectorType.TEXT.value: "text=",
+    SelectorType.CSS.value: "",
+}
+
+_BLOCKED_EXTENSIONS = ("png", "jpg", "jpeg", "gif", "webp", "avif", "bmp", "ico",
+                       "woff", "woff2", "ttf", "otf", "eot",
+                       "mp4", "webm", "mov", "mp3", "wav", "ogg")
+_BLOCKED_URL_PATTERNS = [pattern for ext in _BLOCKED_EXTENSIONS for pattern in (f"*.{ext}", f"*.{ext}?*")]
+
+# Playwright's sync API only works on the thread that started it, while Streamlit runs
+# each session and rerun on its own script thread, so every Playwright call is sent to
+# one dedicated thread that owns the shared Playwright instance
+class PlaywrightThread:
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="playwright")
+        self._playwright = None
+        self._browser = None
+
+    def call(self, fn: Callable, *args, **kwargs) -> Any:
+        return self._executor.submit(fn, *args, **kwargs).result()
+
+    def browser(self):
+        # Must run on the Playwright thread, i.e. from inside call()
+        if self._browser is None or not self._browser.is_connected():
+            if self._playwright is None:
+                from playwright.sync_api import sync_playwright
+                self._playwright = sync_playwright().start()
+            self._browser = self._playwright.chromium.launch(headless=False)
+        return self._browser
+
+@st.cache_resource
+def _playwright_thread() -> PlaywrightThread:
+    # Chromium is launched once per process and shared; each task gets its own context
+    return PlaywrightThread()
 
 class BrowserAgent:
     def __init__(self):
-        self.playwright = sync_playwright().start()
-        self.browser = self.playwright.chromium.launch(headless=False)
-        self.context = self.browser.new_context()
-        self.page = self.context.new_page()
+        self._playwright = _playwright_thread()
+        self.context, self.page, self._cdp = self._playwright.call(self._open_page)
         self.current_url = ""
+        self._content_cache: OrderedDict[Tuple[str, str, int], Any] = OrderedDict()
+        self._last_state: Optional[Dict] = None
+        self._last_state_json: str = ""
+
+    def _open_page(self):
+        context = self._playwright.browser().new_context()
+        page = context.new_page()
+        # The planner only reads the DOM, so skip downloading images, media and fonts.
+        # Blocking happens inside Chromium: a Playwright route handler would stall every
+        # request while the sync API is idle waiting on the planner.
+        cdp = context.new_cdp_session(page)
+        cdp.send("Network.enable")
+        cdp.send("Network.setBlockedURLs", {"urls": _BLOCKED_URL_PATTERNS})
+        return context, page, cdp
 
     def close(self):
-        self.context.close()
-        self.browser.close()
-        self.playwright.stop()
+        self._playwright.call(self.context.close)
 
     def navigate_to_url(self, url: str) -> bool:
         try:
-            self.page.goto(url)
+            self._playwright.call(self.page.goto, url, wait_until="domcontentloaded", timeout=15000)
             self.current_url = url
             return True
         except Exception as e:
             st.error(f"Navigation error: {str(e)}")
             return False
 
-    def _get_selector(self, selector_type: SelectorType, selector: str) -> str:
-        if selector_type == SelectorType.ID:
-            return f"#{selector}"
-        elif selector_type == SelectorType.CLASS:
-            return f".{selector}"
-        elif selector_type == SelectorType.XPATH:
-            return selector
-        elif selector_type == SelectorType.TEXT:
-            return f"text={selector}"
-        else:
-            return selector
+    def _get_selector(self, selector_type: Optional[str], selector: str) -> str:
+        return _SELECTOR_PREFIX.get(selector_type, "") + selector
 
-    def find_and_click(self, selector_type: SelectorType, selector: str, timeout: int = 10000) -> bool:
+    def find_and_click(self, selector_type: Optional[str], selector: str, timeout: int = 10000) -> bool:
         try:
             full_selector = self._get_selector(selector_type, selector)
-            self.page.click(full_selector, timeout=timeout)
+            self._playwright.call(self.page.click, full_selector, timeout=timeout)
             return True
         except Exception as e:
             st.error(f"Click error: {str(e)}")
             return False
 
-    def find_and_type(self, selector_type: SelectorType, selector: str, text: str, timeout: int = 10000) -> bool:
+    def find_and_type(self, selector_type: Optional[str], selector: str, text: str, timeout: int = 10000) -> bool:
         try:
             full_selector = self._get_selector(selector_type, selector)
-            self.page.fill(full_selector, text, timeout=timeout)
+            self._playwright.call(self.page.fill, full_selector, text, timeout=timeout)
             return True
         except Exception as e:
             st.error(f"Type error: {str(e)}")
             return False
 
-    def extract_content(self, selector_type: SelectorType, selector: str, timeout: int = 10000) -> Optional[str]:
+    def extract_content(self, selector_type: Optional[str], selector: str, timeout: int = 10000) -> Optional[str]:
         try:
             full_selector = self._get_selector(selector_type, selector)
-            element = self.page.wait_for_selector(full_selector, timeout=timeout)
-            return element.inner_text() if element else None
+            return self._playwright.call(lambda: self.page.locator(full_selector).first.inner_text(timeout=timeout))
         except Exception as e:
             st.error(f"Extract error: {str(e)}")
             return None
 
-    def wait_for_element(self, selector_type: SelectorType, selector: str, timeout: int = 10000) -> bool:
+    def wait_for_element(self, selector_type: Optional[str], selector: str, timeout: int = 10000) -> bool:
         try:
             full_selector = self._get_selector(selector_type, selector)
-            self.page.wait_for_selector(full_selector, timeout=timeout)
+            self._playwright.call(self.page.wait_for_selector, full_selector, timeout=timeout)
             return True
         except Exception as e:
             st.error(f"Wait error: {str(e)}")
@@ -119,93 +292,197 @@ class BrowserAgent:
     def get_current_url(self) -> str:
         return self.current_url
         
+    def get_current_state(self) -> Dict:
+        current_url = self.get_current_url()
+        page_content = self.get_page_skeleton()
+        last = self._last_state
+        # Snapshots are cached, so an unchanged page hands back the same skeleton
+        # object and the previously serialized state can be reused as-is
+        if last is None or last["current_url"] != current_url or last["page_content"] is not page_content:
+            self._last_state = {"current_url": current_url, "page_content": page_content}
+            self._last_state_json = _serialize_state(self._last_state)
+        return self._last_state
+
+    def get_current_state_json(self) -> str:
+        return self._last_state_json
+
     def get_page_content(self) -> str:
         try:
-            html_content = self.page.content()
-            soup = BeautifulSoup(html_content, 'html.parser')
-            for script in soup(["script", "style", "meta", "svg"]):
-                script.extract()
-            return str(soup)
+            return self._cached_snapshot("content", self._clean_html)
         except Exception as e:
             st.error(f"Error extracting page content: {str(e)}")
             return ""
 
+    def get_page_skeleton(self) -> Dict:
+        try:
+            return self._cached_snapshot("skeleton", self._build_skeleton)
+        except Exception as e:
+            st.error(f"Error extracting page skeleton: {str(e)}")
+            return {"elements": [], "text": ""}
+
+    def _cached_snapshot(self, kind: str, builder) -> Any:
+        raw_html, page_url = self._playwright.call(lambda: (self.page.content(), self.page.url))
+        key = (kind, page_url, hash(raw_html))
+        cached = self._content_cache.get(key)
+        if cached is not None:
+            self._content_cache.move_to_end(key)
+            return cached
+
+        snapshot = builder(raw_html)
+        self._content_cache[key] = snapshot
+        if len(self._content_cache) > _CONTENT_CACHE_SIZE:
+            self._content_cache.popitem(last=False)
+        return snapshot
+
+    def _clean_html(self, raw_html: str) -> str:
+        html_content = _strip_noise(raw_html)
+        lexbor_parser = _lexbor_parser_class()
+        if lexbor_parser is not None:
+            tree = lexbor_parser(html_content)
+            for tag in ("script", "style", "meta", "svg"):
+                for node in tree.css(tag):
+                    node.decompose()
+            return tree.html
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(html_content, 'lxml')
+        for node in list(_soup_selector("script,style,meta,svg").iselect(soup)):
+            node.decompose()
+        return str(soup)
+
+    def _build_skeleton(self, raw_html: str) -> Dict:
+        html_content = _strip_noise(raw_html)
+        lexbor_parser = _lexbor_parser_class()
+        if lexbor_parser is not None:
+            tree = lexbor_parser(html_content)
+            # Lexbor yields a node once per matching selector in the group, so dedupe by node identity.
+            interactive = {node.mem_id for node in tree.css(_SKELETON_SELECTOR)}
+            unique_nodes = {node.mem_id: node for node in tree.css(_SKELETON_TEXT_SELECTOR)}.values()
+            nodes = [(node.tag, node.attributes, node.mem_id in interactive, node.text(deep=False, strip=True),
+                      functools.partial(node.text, separator=" ", strip=True))
+                     for node in unique_nodes]
+            body_text = tree.body.text(separator=" ", strip=True) if tree.body else ""
+        else:
+            from bs4 import BeautifulSoup
+            soup = BeautifulSoup(html_content, 'lxml')
+            interactive = _soup_selector(_SKELETON_SELECTOR)
+            nodes = [(el.name, el.attrs, interactive.match(el),
+                      " ".join(text.strip() for text in el.find_all(string=True, recursive=False) if text.strip()),
+                      functools.partial(el.get_text, " ", strip=True))
+                     for el in _soup_selector(_SKELETON_TEXT_SELECTOR).select(soup)]
+            body_text = soup.body.get_text(" ", strip=True) if soup.body else ""
+
+        elements = []
+        for tag, attrs, is_interactive, own_text, deep_text in nodes:
+            element = {"tag": tag}
+            for attr in _SKELETON_ATTRS:
+                value = _clean_class(attrs.get(attr)) if attr == "class" else attrs.get(attr)
+                if value:
+                    element[attr] = value
+
+            if is_interactive:
+                text = deep_text()
+            elif not any(attr in element for attr in _SKELETON_TARGET_ATTRS):
+                continue
+            else:
+                # Only the element's own text, so wrappers don't repeat their children's text
+                text = own_text
+                if not text and any(attr in element for attr in _SKELETON_TEST_ATTRS):
+                    # Test hooks often wrap one short value split across children (e.g. "8.2" "/10")
+                    text = deep_text()
+                    if len(text) > _SKELETON_TEXT_LIMIT:
+                        continue
+                if not text:
+                    continue
+
+            if text:
+                element["text"] = " ".join(text.split())[:_SKELETON_TEXT_LIMIT]
+            elements.append(element)
+            if len(elements) >= _SKELETON_MAX_ELEMENTS:
+                break
+        return {
+            "elements": elements,
+            "text": " ".join(body_text.split())[:_SKELETON_BODY_TEXT_LIMIT]
+        }
+
+# AsyncOpenAI's pooled connections are bound to the event loop that opened them, so one
+# loop and one client are shared by every session. Sessions run on their own script
+# threads and a loop can't run twice at once, so planner calls take turns on it.
+class OpenAILoop:
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._lock = threading.Lock()
+        self._client = None
+
+    def run(self, coro) -> Any:
+        # Runs on the calling script thread so st.* calls inside the coroutine still work
+        with self._lock:
+            return self._openai.run(coro)
+
+    def client(self):
+        if self._client is None:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI()
+        return self._client
+
+@st.cache_resource
+def _openai_loop() -> OpenAILoop:
+    return OpenAILoop()
+
 class TaskPlanner:
     def __init__(self):
         self.session_id = str(uuid.uuid4())[:8]
-        self.log_file = "llm_interactions.json"
-        self.system_prompt = """
-        You are a browser automation expert that helps execute web navigation tasks one step at a time.
-        Your role is to determine the NEXT SINGLE action to take based on the current state and user's request.
-        
-        For each request:
-        1. Consider what the user is trying to achieve
-        2. Look at the current browser state (if provided)
-           - The current_url shows the page the user is on
-           - The page_content contains the HTML content of the webpage with script and style tags removed
-           - Use this HTML content to identify elements by their attributes, structure, and visible text
-        3. Determine the single most appropriate next action
-        4. If you need user input, request it
-        
-        Available action_types:
-        - "navigate": Go to a URL (input_value=URL)
-        - "click": Click an element
-        - "type": Enter text into a field
-        - "extract": Get text from an element
-        - "wait": Wait for an element to appear
-        - "finished": Task is complete, no more actions needed
-        
-        Available selector_types:
-        - "id": Use element ID
-        - "class": Use CSS class
-        - "xpath": Use XPath
-        - "text": Find by exact text
-        - "css": Use CSS selector
-        
-        Respond in JSON format with this exact structure for the NEXT SINGLE action to take:
-        {
-            "action_type": "navigate|click|type|extract|wait|finished",
-            "selector_type": "id|class|xpath|text|css" (optional),
-            "selector": "element_selector" (optional),
-            "input_value": "text_to_type_or_url" (optional),
-            "requires_user_input": boolean,
-            "user_prompt": "Question to ask user" (if requires_user_input=true),
-            "timeout": milliseconds (default=10000),
-            "explanation": "Brief explanation of what this action accomplishes",
-        }
-        
-        For the first action, if it makes sense to visit a website, use action_type="navigate".
-        When navigating to websites, make sure that you're sure that the website URL actually exists.
-        If the task is complete, use action_type="finished" and include a summary of what was accomplished.
-        
-        Examples:
-        
-        1. First action for "Check weather in New York":
-        {
-            "action_type": "navigate",
-            "input_value": "https://weather.com",
-            "requires_user_input": false,
-            "explanation": "Navigating to Weather.com to check the forecast",
-        }
-        
-        2. First action for "Order pizza from Domino's":
-        {
-            "action_type": "navigate",
-            "input_value": "https://dominos.com",
-            "requires_user_input": false,
-            "explanation": "Navigating to Domino's Pizza website", 
-        }
-        
-        3. Task completion example:
-        {
-            "action_type": "finished",
-            "explanation": "Successfully added basketball to cart on Amazon",
-        }
-        """
+        self.log_file = "llm_interactions.jsonl"
+        # The warm prompt drops the first-action guidance and navigate examples once the
+        # browser is on a page; both stay stable so each keeps a cacheable prefix. The
+        # response shape is enforced by _RESPONSE_FORMAT, so only field meanings are described.
+        base_prompt = textwrap.dedent("""\
+            You are a browser automation expert that helps execute web navigation tasks one step at a time.
+            Your role is to determine the NEXT SINGLE action to take based on the current state and user's request.
+
+            For each request:
+            1. Consider what the user is trying to achieve
+            2. Look at the current browser state (if provided): current_url is the page the user is on, and
+            page_content lists the page's interactive elements, headings and other elements with an id, class
+            or test hook (data-testid, data-test, data-qa) that contain text, with their attributes and text,
+            plus the page's visible text. Use these to identify what to interact with.
+            3. Determine the single most appropriate next action
+            4. If you need user input, set requires_user_input and ask in user_prompt
+
+            action_type: "navigate" (go to the input_value URL), "click", "type" (enter input_value into a field),
+            "extract" (get an element's text), "wait" (for an element to appear), "finished" (task is complete).
+            selector_type: "id", "class", "xpath", "text" (exact text) or "css", with selector as the value.
+            timeout is in milliseconds (default 10000). Use null for fields that don't apply.
+
+            For click, type, extract and wait actions, set fallback_action to an alternative way to do the same
+            step (e.g. a different selector for the same element). It runs only if the primary action fails.
+
+            When navigating to websites, make sure that you're sure that the website URL actually exists.
+            If the task is complete, use action_type="finished" and summarize what was accomplished in explanation.
+            """)
+        self.cold_prompt = base_prompt + textwrap.dedent("""\
+
+            For the first action, if it makes sense to visit a website, use action_type="navigate". For example,
+            "Check weather in New York" navigates to https://weather.com and "Order pizza from Domino's" to
+            https://dominos.com.
+            """)
+        self.warm_prompt = base_prompt
 
         with open(self.log_file, "w") as f:
             f.write("")
 
+        self._openai = _openai_loop()
+
+        self._action_cache: OrderedDict[str, str] = OrderedDict()
+        self._last_action_key: Optional[str] = None
+        try:
+            os.makedirs(os.path.dirname(_ACTION_CACHE_PATH), exist_ok=True)
+            with contextlib.closing(sqlite3.connect(_ACTION_CACHE_PATH)) as conn, conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS actions (key TEXT PRIMARY KEY, response TEXT NOT NULL)")
+        except sqlite3.Error as e:
+            st.warning(f"Action cache persistence disabled: {str(e)}")
+
+    def run(self, coro) -> Any:
+        return self._openai.run(coro)
 
     def log_llm_interaction(self, interaction_type: str, messages: List[Dict], response_content: str, result: Dict) -> None:
         try:
@@ -216,78 +493,151 @@ class TaskPlanner:
                 "interaction_type": interaction_type,
                 "messages": messages,
                 "response": response_content,
-                "parsed_result": result
+                # Snapshot: the caller keeps mutating the result (e.g. filling in user input)
+                "parsed_result": copy.deepcopy(result)
             }
-            
-            try:
-                with open(self.log_file, "r") as f:
-                    try:
-                        logs = json.load(f)
-                    except json.JSONDecodeError:
-                        logs = []
-            except FileNotFoundError:
-                logs = []
-            
-            logs.append(log_entry)
-            
-            with open(self.log_file, "w") as f:
-                json.dump(logs, f, indent=2)
-                
+
+            _write_async(self.log_file, "a", lambda: _serialize_log_entry(log_entry))
+
         except Exception as e:
             st.error(f"Error logging LLM interaction: {str(e)}")
-    
-    def get_next_action(self, user_input: str, current_state: Optional[Dict] = None, conversation_history: Optional[List[Dict]] = None) -> Dict:
+
+    def _action_cache_key(self, messages: List[Dict]) -> str:
+        # The key covers the whole prompt (task, history and page state), so a hit
+        # means the planner would be asked exactly the same question again
+        serialized = json.dumps(messages, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.blake2b(serialized.encode(), digest_size=16).hexdigest()
+
+    def _get_cached_action(self, key: str) -> Optional[str]:
+        response_content = self._action_cache.get(key)
+        if response_content is not None:
+            self._action_cache.move_to_end(key)
+            return response_content
+
+        try:
+            with contextlib.closing(sqlite3.connect(_ACTION_CACHE_PATH)) as conn:
+                row = conn.execute("SELECT response FROM actions WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        self._remember_action(key, row[0])
+        return row[0]
+
+    def _cache_action(self, key: str, response_content: str) -> None:
+        self._remember_action(key, response_content)
+        try:
+            with contextlib.closing(sqlite3.connect(_ACTION_CACHE_PATH)) as conn, conn:
+                conn.execute("INSERT OR REPLACE INTO actions (key, response) VALUES (?, ?)", (key, response_content))
+                # REPLACE assigns a fresh rowid, so the newest entries have the highest rowids
+                conn.execute("DELETE FROM actions WHERE rowid NOT IN "
+                             "(SELECT rowid FROM actions ORDER BY rowid DESC LIMIT ?)", (_ACTION_CACHE_DB_SIZE,))
+        except sqlite3.Error as e:
+            st.warning(f"Error persisting cached action: {str(e)}")
+
+    def _forget_action(self, key: str) -> None:
+        self._action_cache.pop(key, None)
+        try:
+            with contextlib.closing(sqlite3.connect(_ACTION_CACHE_PATH)) as conn, conn:
+                conn.execute("DELETE FROM actions WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            st.warning(f"Error removing cached action: {str(e)}")
+
+    def _remember_action(self, key: str, response_content: str) -> None:
+        self._action_cache[key] = response_content
+        if len(self._action_cache) > _ACTION_CACHE_SIZE:
+            self._action_cache.popitem(last=False)
+
+    def _build_messages(self, user_input: Optional[str], conversation_history: Optional[List[Dict]],
+                        current_state: Optional[Dict]) -> List[Dict]:
+        # OpenAI caches the longest repeated prompt prefix, so keep the order fixed as
+        # [system prompt, task, conversation history...] and have callers append the
+        # dynamic current state as the final message to keep that prefix cache-hot.
+        system_prompt = self.warm_prompt if current_state and current_state.get("current_url") else self.cold_prompt
         messages = [
-            {"role": "system", "content": self.system_prompt},
+            {"role": "system", "content": system_prompt},
         ]
-        
+
+        task_in_history = bool(conversation_history) and conversation_history[0].get("content") == user_input
+        if user_input and not task_in_history:
+            messages.append({"role": "user", "content": user_input})
+
         if conversation_history:
             messages.extend(conversation_history)
-        else:
-            messages.append({"role": "user", "content": user_input})
-            
-        if current_state:
-            messages.append({"role": "user", "content": f"Current state: {json.dumps(current_state)}"})
 
-        with open("dump.json", "w") as f:
-            json.dump(current_state, f)
-        
-        response = client.chat.completions.create(
+        return messages
+
+    async def _stream_completion(self, messages: List[Dict]) -> str:
+        response = await self._openai.client().chat.completions.create(
             model="gpt-4.1",
             messages=messages,
-            response_format={"type": "json_object"}
+            response_format=_RESPONSE_FORMAT,
+            user=self.session_id,
+            stream=True
         )
 
-        response_content = response.choices[0].message.content
+        # Show the explanation as it streams in so the UI isn't idle for the whole response
+        placeholder = st.empty()
+        response_content = ""
+        # Closing the stream releases its pooled connection even if iteration is cut short
+        async with response:
+            async for chunk in response:
+                if not chunk.choices:
+                    continue
+                response_content += chunk.choices[0].delta.content or ""
+                match = _PARTIAL_EXPLANATION_RE.search(response_content)
+                explanation = _decode_partial_json_string(match.group(1)) if match else None
+                if explanation:
+                    placeholder.write(explanation)
+        placeholder.empty()
+
+        return response_content
+
+    async def get_next_action(self, user_input: str, current_state: Optional[Dict] = None, conversation_history: Optional[List[Dict]] = None,
+                              current_state_json: Optional[str] = None) -> Dict:
+        messages = self._build_messages(user_input, conversation_history, current_state)
+
+        if current_state:
+            state_json = current_state_json or _serialize_state(current_state)
+            messages.append({"role": "user", "content": f"Current state: {state_json}"})
+
+        if DEBUG:
+            _write_async("dump.json", "w", lambda: json.dumps(current_state))
+        
+        cache_key = self._action_cache_key(messages)
+        self._last_action_key = cache_key
+        response_content = self._get_cached_action(cache_key)
+        cached = response_content is not None
+        if not cached:
+            response_content = await self._stream_completion(messages)
         result = json.loads(response_content)
+        if not cached:
+            self._cache_action(cache_key, response_content)
 
-        self.log_llm_interaction("get_next_action", messages, response_content, result)
+        self.log_llm_interaction("get_next_action_cached" if cached else "get_next_action", messages, response_content, result)
 
-        with open("dump.json", "w+") as f:
-            f.write("\n\n\n" + json.dumps(result, indent=4))
+        if DEBUG:
+            dumped_result = copy.deepcopy(result)
+            _write_async("dump.json", "a", lambda: "\n\n\n" + json.dumps(dumped_result, indent=4))
         
         if conversation_history is not None:
             conversation_history.append({"role": "assistant", "content": json.dumps(result)})
         
         return result
 
-    def handle_error(self, error: str, current_state: Dict, conversation_history: List[Dict]) -> Dict:
-        messages = [
-            {"role": "system", "content": self.system_prompt},
-        ]
-        
-        if conversation_history:
-            messages.extend(conversation_history)
-            
-        messages.append({"role": "user", "content": f"Error occurred: {error}\nCurrent state: {json.dumps(current_state)}\nPlease provide an alternative approach."})        
+    async def handle_error(self, error: str, current_state: Dict, conversation_history: List[Dict],
+                           current_state_json: Optional[str] = None) -> Dict:
+        # The last planned action failed, so don't replay it from the cache in later sessions
+        if self._last_action_key is not None:
+            self._forget_action(self._last_action_key)
+            self._last_action_key = None
 
-        response = client.chat.completions.create(
-            model="gpt-4.1",
-            messages=messages,
-            response_format={"type": "json_object"}
-        )
+        messages = self._build_messages(None, conversation_history, current_state)
+
+        state_json = current_state_json or _serialize_state(current_state)
+        messages.append({"role": "user", "content": f"Error occurred: {error}\nCurrent state: {state_json}\nPlease provide an alternative approach."})
 
-        response_content = response.choices[0].message.content
+        response_content = await self._stream_completion(messages)
         result = json.loads(response_content)
         
         self.log_llm_interaction("handle_error", messages, response_content, result)
@@ -298,38 +648,70 @@ class TaskPlanner:
         return result
 
 def execute_browser_action(agent: BrowserAgent, action_data: Dict) -> Tuple[bool, Optional[str]]:
-    action_type = ActionType(action_data["action_type"]) if "action_type" in action_data else None
-    
-    if action_type == ActionType.FINISHED:
-        return True, "finished"
-    
-    action = BrowserAction(
-        action_type=action_type,
-        selector_type=SelectorType(action_data.get("selector_type")) if action_data.get("selector_type") else None,
-        selector=action_data.get("selector"),
-        input_value=action_data.get("input_value"),
-        requires_user_input=action_data.get("requires_user_input", False),
-        user_prompt=action_data.get("user_prompt"),
-        timeout=action_data.get("timeout", 10000)
-    )
-    
-    if action.action_type == ActionType.NAVIGATE:
-        success = agent.navigate_to_url(action.input_value)
-        return success, None
-    elif action.action_type == ActionType.CLICK:
-        success = agent.find_and_click(action.selector_type, action.selector, action.timeout)
-        return success, None
-    elif action.action_type == ActionType.TYPE:
-        success = agent.find_and_type(action.selector_type, action.selector, action.input_value, action.timeout)
-        return success, None
-    elif action.action_type == ActionType.EXTRACT:
-        content = agent.extract_content(action.selector_type, action.selector, action.timeout)
-        return content is not None, content
-    elif action.action_type == ActionType.WAIT:
-        success = agent.wait_for_element(action.selector_type, action.selector, action.timeout)
-        return success, None
-    
-    return False, None
+    success, extracted = _execute_single_action(agent, action_data)
+    fallback_action = action_data.get("fallback_action")
+    if not success and fallback_action:
+        st.warning("Primary action failed, trying fallback action...")
+        return _execute_single_action(agent, fallback_action)
+    return success, extracted
+
+def _do_navigate(agent: BrowserAgent, action_data: Dict) -> Tuple[bool, Optional[str]]:
+    return agent.navigate_to_url(action_data.get("input_value")), None
+
+def _do_click(agent: BrowserAgent, action_data: Dict) -> Tuple[bool, Optional[str]]:
+    success = agent.find_and_click(action_data.get("selector_type"), action_data.get("selector"),
+                                   action_data.get("timeout") or 10000)
+    return success, None
+
+def _do_type(agent: BrowserAgent, action_data: Dict) -> Tuple[bool, Optional[str]]:
+    success = agent.find_and_type(action_data.get("selector_type"), action_data.get("selector"),
+                                  action_data.get("input_value"), action_data.get("timeout") or 10000)
+    return success, None
+
+def _do_extract(agent: BrowserAgent, action_data: Dict) -> Tuple[bool, Optional[str]]:
+    content = agent.extract_content(action_data.get("selector_type"), action_data.get("selector"),
+                                    action_data.get("timeout") or 10000)
+    return content is not None, content
+
+def _do_wait(agent: BrowserAgent, action_data: Dict) -> Tuple[bool, Optional[str]]:
+    success = agent.wait_for_element(action_data.get("selector_type"), action_data.get("selector"),
+                                     action_data.get("timeout") or 10000)
+    return success, None
+
+def _do_finished(agent: BrowserAgent, action_data: Dict) -> Tuple[bool, Optional[str]]:
+    return True, "finished"
+
+_ACTION_DISPATCH = {
+    ActionType.NAVIGATE.value: _do_navigate,
+    ActionType.CLICK.value: _do_click,
+    ActionType.TYPE.value: _do_type,
+    ActionType.EXTRACT.value: _do_extract,
+    ActionType.WAIT.value: _do_wait,
+    ActionType.FINISHED.value: _do_finished,
+}
+
+def _execute_single_action(agent: BrowserAgent, action_data: Dict) -> Tuple[bool, Optional[str]]:
+    handler = _ACTION_DISPATCH.get(action_data.get("action_type"))
+    if handler is None:
+        return False, None
+    return handler(agent, action_data)
+
+_MUTATING_ACTIONS = frozenset({
+    ActionType.NAVIGATE.value,
+    ActionType.CLICK.value,
+    ActionType.TYPE.value,
+    ActionType.WAIT.value,
+})
+
+def get_planner_state() -> Dict:
+    # Reuse the last snapshot until an executed action may have changed the page
+    if st.session_state.state_dirty or st.session_state.cached_state is None:
+        st.session_state.cached_state = st.session_state.agent.get_current_state()
+        st.session_state.state_dirty = False
+        if DEBUG:
+            page_html = st.session_state.agent.get_page_content()
+            _write_async("dump.html", "w", lambda: page_html)
+    return st.session_state.cached_state
 
 def main():
     st.title("Browser Agent")
@@ -354,6 +736,10 @@ def main():
         st.session_state.task_progress = ""
     if 'extracted_content' not in st.session_state:
         st.session_state.extracted_content = None
+    if 'cached_state' not in st.session_state:
+        st.session_state.cached_state = None
+    if 'state_dirty' not in st.session_state:
+        st.session_state.state_dirty = True
 
     if not st.session_state.user_task:
         user_input = st.text_input("What would you like me to do?", key="task_input")
@@ -373,15 +759,13 @@ def main():
         
         if not st.session_state.current_action:
             with st.spinner("Thinking about next step..."):
-                current_state = {
-                    "current_url": st.session_state.agent.get_current_url() if st.session_state.agent else "",
-                    "page_content": st.session_state.agent.get_page_content() if st.session_state.agent else ""
-                }
-                st.session_state.current_action = st.session_state.task_planner.get_next_action(
+                current_state = get_planner_state()
+                st.session_state.current_action = st.session_state.task_planner.run(st.session_state.task_planner.get_next_action(
                     st.session_state.user_task,
                     current_state,
-                    st.session_state.conversation_history
-                )
+                    st.session_state.conversation_history,
+                    st.session_state.agent.get_current_state_json()
+                ))
         
         if "explanation" in st.session_state.current_action:
             st.write(st.session_state.current_action["explanation"])
@@ -390,7 +774,7 @@ def main():
             st.session_state.task_progress = st.session_state.current_action["task_progress"]
 
         requires_input = st.session_state.current_action.get("requires_user_input", False)
-        user_prompt = st.session_state.current_action.get("user_prompt", "")
+        user_prompt = st.session_state.current_action.get("user_prompt") or ""
         
         if requires_input and user_prompt not in st.session_state.user_inputs:
             user_response = st.text_input(user_prompt, key="user_response")
@@ -402,7 +786,11 @@ def main():
         else:
             with st.spinner("Executing action..."):
                 success, extracted = execute_browser_action(st.session_state.agent, st.session_state.current_action)
-                
+                fallback_action = st.session_state.current_action.get("fallback_action") or {}
+                executed_types = {st.session_state.current_action.get("action_type"), fallback_action.get("action_type")}
+                if not success or executed_types & _MUTATING_ACTIONS:
+                    st.session_state.state_dirty = True
+
                 if success:
                     if st.session_state.current_action.get("action_type") == "finished":
                         st.success("Task completed!")
@@ -418,6 +806,8 @@ def main():
                             st.session_state.finished = False
                             st.session_state.task_progress = ""
                             st.session_state.extracted_content = None
+                            st.session_state.cached_state = None
+                            st.session_state.state_dirty = True
                             st.rerun()
                     else:
                         if extracted:
@@ -429,15 +819,13 @@ def main():
                 else:
                     st.error("Error occurred during action execution")
                     with st.spinner("Finding alternative approach..."):
-                        current_state = {
-                            "current_url": st.session_state.agent.get_current_url(),
-                            "page_content": st.session_state.agent.get_page_content()
-                        }
-                        st.session_state.current_action = st.session_state.task_planner.handle_error(
+                        current_state = get_planner_state()
+                        st.session_state.current_action = st.session_state.task_planner.run(st.session_state.task_planner.handle_error(
                             "Action failed",
                             current_state,
-                            st.session_state.conversation_history
-                        )
+                            st.session_state.conversation_history,
+                            st.session_state.agent.get_current_state_json()
+                        ))
                         st.rerun()
 
 if __name__ == "__main__":